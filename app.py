@@ -1,6 +1,10 @@
-from __future__ import print_function
+import concurrent.futures
 import datetime
-import os.path
+import functools
+import hashlib
+import os
+import tempfile
+import time
 import pytz
 import streamlit as st
 from google.auth.transport.requests import Request
@@ -8,30 +12,60 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow  # Ensure Flow is imported
 from googleapiclient.discovery import build
 import googleapiclient.errors
+import googleapiclient.http
+import google_auth_httplib2
+import httplib2
 import json
-from dateutil.parser import isoparse  # <-- Added import here
+import operator
+
+try:
+    import orjson  # Faster history (de)serialization when available
+except ImportError:
+    orjson = None
+
+SRI_LANKA_TZ = pytz.timezone('Asia/Colombo')
+
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)  # Refresh tokens this long before they expire
+
+VERIFY_INTERVAL = 60  # Seconds before stored events are checked against the calendar again
+
+EVENTS_PAGE_SIZE = 20  # Sidebar event cards rendered per page
+
+API_RETRIES = 3  # execute() retries 5xx, 429 and rate-limit 403s with exponential backoff
 
 SCOPES = ['https://www.googleapis.com/auth/calendar.events.readonly', 'https://www.googleapis.com/auth/calendar.events']
 
-@st.cache_data
+COLOR_IDS = {
+    'physics': '7',  # Peacock
+    'p6': '7',
+    'chemistry': '6',  # Tangerine
+    'chem': '6',
+    'combined maths': '10',  # Basil
+    'c.m.': '10',
+}
+
 def get_color_id(subject: str) -> str:
-    subject = subject.lower()
-    if subject in ['physics', 'p6']:
-        return '7'  # Peacock
-    elif subject in ['chemistry', 'chem']:
-        return '6'  # Tangerine
-    elif subject in ['combined maths', 'c.m.']:
-        return '10'  # Basil
-    else:
-        return '1'  # Default (Lavender)
+    return COLOR_IDS.get(subject.lower(), '1')  # Default (Lavender)
 
-@st.cache_data
 def convert_to_sri_lanka_time(dt: datetime.datetime) -> datetime.datetime:
-    sri_lanka_tz = pytz.timezone('Asia/Colombo')
-    return dt.astimezone(sri_lanka_tz)
+    return dt.astimezone(SRI_LANKA_TZ)
 
 
 
+def parse_event_time(value: str) -> datetime.datetime:
+    # Google returns RFC 3339; older Pythons can't read the trailing 'Z'
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+# One worker per process, so background token refreshes never race each other
+@st.cache_resource
+def get_refresh_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def refresh_token(token):
+    creds = Credentials.from_authorized_user_info(json.loads(token), SCOPES)
+    creds.refresh(Request())
+    return creds.to_json()
+
 def get_credentials():
     creds = None
     
@@ -39,15 +73,29 @@ def get_credentials():
     if 'token' not in st.session_state:
         st.session_state['token'] = None
 
+    # Pick up a token refreshed in the background on an earlier run
+    pending_refresh = st.session_state.get('token_refresh')
+    if pending_refresh and pending_refresh.done():
+        st.session_state['token_refresh'] = None
+        if pending_refresh.exception() is None:
+            st.session_state['token'] = pending_refresh.result()
+
     # Check if token exists and convert it from a JSON string to a dictionary
     if st.session_state['token']:
         creds = Credentials.from_authorized_user_info(json.loads(st.session_state['token']), SCOPES)
+
+    # Still valid but close to expiry: refresh off the request path and keep using the current token
+    if creds and creds.valid and creds.refresh_token and creds.expiry and not st.session_state.get('token_refresh'):
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)  # google-auth keeps expiry as naive UTC
+        if creds.expiry - now < TOKEN_REFRESH_MARGIN:
+            st.session_state['token_refresh'] = get_refresh_executor().submit(refresh_token, st.session_state['token'])
     
     # Refresh or initiate a new flow if creds are invalid or expired
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             try:
                 creds.refresh(Request())
+                st.session_state['token'] = creds.to_json()
             except Exception as e:
                 st.error(f"Error refreshing credentials: {e}")
                 creds = None
@@ -80,113 +128,394 @@ def get_credentials():
 
     return creds
 
-
-
-
-
-def get_existing_events(service, calendar_id='primary', time_min=None, time_max=None):
+# Keyed on the access token so a refreshed or different login gets its own client; _creds itself isn't hashed
+@st.cache_resource(max_entries=8)
+def get_service(token, _creds):
+    # httplib2 isn't thread-safe and Streamlit sessions run on separate threads, so give each request its own Http
+    def build_request(http, *args, **kwargs):
+        return googleapiclient.http.HttpRequest(google_auth_httplib2.AuthorizedHttp(_creds, http=httplib2.Http()), *args, **kwargs)
+
+    return build('calendar', 'v3', credentials=_creds, requestBuilder=build_request, cache_discovery=False, static_discovery=True)
+
+
+
+
+# Partial-response mask: only the fields the sidebar reads (all-day events carry start/end 'date')
+EXISTING_EVENT_FIELDS = 'items(id,summary,description,start(date,dateTime),end(date,dateTime)),nextPageToken'
+
+# Short-lived cache so reruns from unrelated widgets don't re-list the day; the leading underscore keeps the service out of the cache key.
+# The cache is shared by every session in the process, so the user's access token is part of the key
+@st.cache_data(ttl=60, show_spinner=False)
+def list_events_cached(_service, token, calendar_id, time_min, time_max, fields):
+    # The API's largest page, so a day fits in one request; follow nextPageToken for the rest
+    items = []
+    page_token = None
+    while True:
+        events_result = _service.events().list(calendarId=calendar_id, timeMin=time_min, timeMax=time_max, singleEvents=True, orderBy='startTime', maxResults=2500, pageToken=page_token, fields=fields, timeZone=SRI_LANKA_TZ.zone, prettyPrint=False).execute(num_retries=API_RETRIES)
+        items.extend(events_result.get('items', []))
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return items
+
+EXISTING_EVENT_TEMPLATE = '**{description}**\n\n- Time: {start} - {end}\n- Duration: {duration}\n\n---'
+
+# Plain-string arguments make an lru_cache key cheap; reruns reuse the parsed and formatted block
+@functools.lru_cache(maxsize=256)
+def render_existing_event(description, start, end):
+    # Times already carry the Asia/Colombo offset (timeZone on the listing), so no conversion is needed
+    event_start = parse_event_time(start)
+    event_end = parse_event_time(end)
+    return EXISTING_EVENT_TEMPLATE.format_map({
+        'description': description,
+        'start': event_start.strftime('%I:%M %p'),
+        'end': event_end.strftime('%I:%M %p'),
+        'duration': event_end - event_start,
+    })
+
+def get_existing_events(service, token, calendar_id='primary', time_min=None, time_max=None, fields=EXISTING_EVENT_FIELDS):
     try:
-        events_result = service.events().list(calendarId=calendar_id, timeMin=time_min, timeMax=time_max, singleEvents=True, orderBy='startTime').execute()
-        return events_result.get('items', [])
+        return list_events_cached(service, token, calendar_id, time_min, time_max, fields)
     except googleapiclient.errors.HttpError as error:
         st.error(f"An error occurred while fetching events: {error}")
         return []
 
+BATCH_LIMIT = 50
+
+def run_batch(service, requests):
+    # Send (request_id, request) pairs as one multipart HTTP request; collect responses and errors by ID
+    responses, errors = {}, {}
+
+    def collect(request_id, response, exception):
+        if exception is None:
+            responses[request_id] = response
+        else:
+            errors[request_id] = exception
+
+    # The Calendar API accepts at most BATCH_LIMIT calls per batch
+    requests = list(requests)
+    for offset in range(0, len(requests), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=collect)
+        for request_id, request in requests[offset:offset + BATCH_LIMIT]:
+            batch.add(request, request_id=request_id)
+        batch.execute()
+    return responses, errors
+
+HISTORY_PATH = 'event_history.json'
+# Completion toggles are appended here instead of rewriting the snapshot; replayed on load, cleared on each snapshot
+HISTORY_LOG_PATH = 'event_history.log.jsonl'
+HISTORY_LOG_LIMIT = 1 << 20  # Fold the log into the snapshot once it grows past 1 MB
+
+def file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+def history_mtime():
+    return file_mtime(HISTORY_PATH), file_mtime(HISTORY_LOG_PATH)
+
 def get_event_history():
-    if os.path.exists('event_history.json'):
-        with open('event_history.json', 'r') as file:
-            return json.load(file)
+    # The session copy is authoritative once loaded; the file is only re-parsed after another session writes it
+    if 'event_history' in st.session_state:
+        if not st.session_state.get('history_dirty') and history_mtime() != st.session_state.get('history_mtime'):
+            history = load_event_history()
+            st.session_state['event_history'] = history
+        return st.session_state['event_history']
+    return load_event_history()
+
+def dump_history(history) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(history)
+    # Match orjson's compact output so the file and its digest don't depend on which backend wrote it
+    return json.dumps(history, separators=(',', ':'), ensure_ascii=False).encode()
+
+def parse_json(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def load_event_history():
+    st.session_state['history_mtime'] = history_mtime()
+    # The file may hold another session's write, so this session's last digest no longer describes it
+    st.session_state['history_digest'] = None
+    if os.path.exists(HISTORY_PATH):
+        with open(HISTORY_PATH, 'rb') as file:
+            history = parse_json(file.read())
     else:
-        return {'created_events': [], 'completed_events': [], 'missed_events': []}
+        history = {'created_events': [], 'completed_events': [], 'missed_events': []}
+    replay_history_log(history)
+    return history
+
+def replay_history_log(history):
+    if not os.path.exists(HISTORY_LOG_PATH):
+        return
+    sub_events = {sub_event['id']: sub_event for event in history['created_events'] for sub_event in event['sub_events']}
+    with open(HISTORY_LOG_PATH, 'rb') as file:
+        for line in file:
+            try:
+                entry = parse_json(line)
+            except ValueError:
+                continue  # A torn final line from an interrupted append
+            if entry.get('op') == 'toggle' and entry.get('sub_event') in sub_events:
+                sub_events[entry['sub_event']]['completed'] = entry['completed']
+
+def append_history_log(entry):
+    with open(HISTORY_LOG_PATH, 'a+b') as file:
+        # An interrupted append leaves no trailing newline; start a fresh line so this record isn't glued to it
+        if file.seek(0, os.SEEK_END):
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                file.write(b'\n')
+        file.write(dump_history(entry) + b'\n')
+    st.session_state['history_mtime'] = history_mtime()
+    if os.path.getsize(HISTORY_LOG_PATH) > HISTORY_LOG_LIMIT:
+        # Compact: the next flush writes a full snapshot, which clears the log
+        st.session_state['history_digest'] = None
+        mark_history_dirty(get_event_history())
+
+def clear_history_log():
+    try:
+        os.remove(HISTORY_LOG_PATH)
+    except FileNotFoundError:
+        pass
 
 def save_event_history(history):
-    with open('event_history.json', 'w') as file:
-        json.dump(history, file)
+    data = dump_history(history)
+    # Skip the disk write when nothing changed since the last save (e.g. a toggle that was undone)
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    if digest == st.session_state.get('history_digest'):
+        # Snapshot already matches memory, so any logged toggles net out to nothing
+        clear_history_log()
+        st.session_state['history_mtime'] = history_mtime()
+        return
+    # Write to a temp file and swap it in so a crash mid-write can't truncate the history. Each save gets its own
+    # temp file, since sessions run on separate threads and two flushes can overlap
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(HISTORY_PATH)), prefix=HISTORY_PATH + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, HISTORY_PATH)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    # The snapshot now includes every logged toggle
+    clear_history_log()
+    st.session_state['history_mtime'] = history_mtime()
+    st.session_state['history_digest'] = digest
+
+def mark_history_dirty(history):
+    # Mutations only touch session state; flush_event_history() writes once per script run
+    st.session_state['event_history'] = history
+    st.session_state['history_dirty'] = True
+
+def flush_event_history():
+    if st.session_state.get('history_dirty'):
+        save_event_history(st.session_state['event_history'])
+        st.session_state['history_dirty'] = False
+
+HISTORY_KEYS = ('created_events', 'completed_events', 'missed_events')
+
+# Private extended property stamped on every event the app creates, so they can be listed on their own
+APP_EVENT_PROPERTY = ('app', 'spaced-repetition')
+
+def list_live_event_ids(service, time_min=None, time_max=None, private_property=None):
+    # One paginated sweep for IDs only; cancelled events are excluded by default
+    live_ids = set()
+    page_token = None
+    while True:
+        events_result = service.events().list(calendarId='primary', timeMin=time_min, timeMax=time_max, privateExtendedProperty=private_property, singleEvents=True, maxResults=2500, pageToken=page_token, fields='items(id),nextPageToken', prettyPrint=False).execute(num_retries=API_RETRIES)
+        live_ids.update(event['id'] for event in events_result.get('items', []))
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return live_ids
+
+def list_event_changes(service, sync_token=None):
+    # Returns (cancelled IDs, next sync token). Without a token this only pages through the calendar to obtain
+    # one, so no items are requested; with one, only events changed since that token come back
+    fields = 'items(id,status),nextPageToken,nextSyncToken' if sync_token else 'nextPageToken,nextSyncToken'
+    cancelled_ids = set()
+    page_token = None
+    while True:
+        events_result = service.events().list(calendarId='primary', syncToken=sync_token, maxResults=2500, pageToken=page_token, fields=fields, prettyPrint=False).execute(num_retries=API_RETRIES)
+        cancelled_ids.update(event['id'] for event in events_result.get('items', []) if event.get('status') == 'cancelled')
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return cancelled_ids, events_result['nextSyncToken']
+
+# Fetching a sync token pages through a whole calendar, so it gets its own workers rather than
+# queueing ahead of every session's completion patches on the calendar executor
+@st.cache_resource
+def get_sync_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+def filter_history(history, keep):
+    updated_history = {key: [event for event in history[key] if keep(event['id'])] for key in HISTORY_KEYS}
+    changed = any(len(updated_history[key]) != len(history[key]) for key in HISTORY_KEYS)
+    return updated_history, changed
 
 def verify_events(service, history):
-    updated_history = {'created_events': [], 'completed_events': [], 'missed_events': []}
-    for event in history['created_events']:
-        if event_exists(service, event['id']):
-            updated_history['created_events'].append(event)
+    # Returns (history, changed) so callers don't have to compare the nested dicts
+    if not any(history[key] for key in HISTORY_KEYS):
+        return history, False
+    # A token that just arrived still gets one full sweep, which catches deletions made before the token was taken
+    fresh_token = False
+    future = st.session_state.get('sync_token_future')
+    if future is not None and future.done():
+        del st.session_state['sync_token_future']
+        if future.exception() is None:
+            st.session_state['sync_token'] = future.result()[1]
+            fresh_token = True
+    sync_token = st.session_state.get('sync_token')
+    if sync_token and not fresh_token:
+        try:
+            cancelled_ids, st.session_state['sync_token'] = list_event_changes(service, sync_token)
+        except googleapiclient.errors.HttpError as error:
+            if error.resp.status != 410:
+                st.error(f"An error occurred while verifying events: {error}")
+                return history, False
+            # 410 Gone: the token has expired, so fall back to a full sweep and fetch a new one
+            del st.session_state['sync_token']
         else:
-            # Event doesn't exist on calendar, remove from progress bar
-            st.session_state.event_checkboxes.pop(event['id'], None)
-    for event in history['completed_events']:
-        if event_exists(service, event['id']):
-            updated_history['completed_events'].append(event)
-    for event in history['missed_events']:
-        if event_exists(service, event['id']):
-            updated_history['missed_events'].append(event)
-    return updated_history
-
-# Function to check if event exists on Google Calendar
-def event_exists(service, event_id):
+            return filter_history(history, lambda event_id: event_id not in cancelled_ids)
+    if 'sync_token' not in st.session_state and 'sync_token_future' not in st.session_state:
+        st.session_state['sync_token_future'] = get_sync_executor().submit(list_event_changes, service)  # Off the UI path
     try:
-        service.events().get(calendarId='primary', eventId=event_id).execute()
-        return True
-    except googleapiclient.errors.HttpError:
-        return False
+        if all(event.get('tagged') for key in HISTORY_KEYS for event in history[key]):
+            # Every stored event carries the app's property, so only the app's own events need listing
+            live_ids = list_live_event_ids(service, private_property='='.join(APP_EVENT_PROPERTY))
+        else:
+            # Stored IDs are normally Day-1 reviews, which start the day after the study date; allow a day either side
+            # for time zones. Undated events could be anywhere, so any of them means an unbounded sweep
+            dates = [event['date'] for key in HISTORY_KEYS for event in history[key] if 'date' in event]
+            time_min = time_max = None
+            if dates and len(dates) == sum(len(history[key]) for key in HISTORY_KEYS):
+                time_min = (datetime.datetime.fromisoformat(min(dates)) - datetime.timedelta(days=1)).isoformat() + 'Z'
+                time_max = (datetime.datetime.fromisoformat(max(dates)) + datetime.timedelta(days=2)).isoformat() + 'Z'
+            live_ids = list_live_event_ids(service, time_min=time_min, time_max=time_max)
+            # The window is only a first pass: a moved review or a partial series stored under a later review's ID can
+            # sit outside it, so an unlisted ID is dropped only once a direct get confirms it's gone (404/410)
+            unlisted = [event['id'] for key in HISTORY_KEYS for event in history[key] if event['id'] not in live_ids]
+            _, get_errors = run_batch(service, [(event_id, service.events().get(calendarId='primary', eventId=event_id, fields='id')) for event_id in unlisted])
+            live_ids.update(event_id for event_id in unlisted if event_id not in get_errors or get_errors[event_id].resp.status not in (404, 410))
+    except googleapiclient.errors.HttpError as error:
+        # Without a completed sweep the token would skip deletions made before it, so discard it
+        st.session_state.pop('sync_token', None)
+        pending_token = st.session_state.pop('sync_token_future', None)
+        if pending_token is not None:
+            pending_token.cancel()
+        st.error(f"An error occurred while verifying events: {error}")
+        return history, False
+    return filter_history(history, live_ids.__contains__)
 
 def reset_progress():
     updated_history = get_event_history()
     for event in updated_history['created_events']:
         for sub_event in event['sub_events']:
             sub_event['completed'] = False
-    save_event_history(updated_history)
-    # Update session state directly
-    st.session_state['event_history'] = updated_history
+    mark_history_dirty(updated_history)
+
+# A single worker applies calendar updates in submission order, so a quick on/off toggle can't land reversed
+@st.cache_resource
+def get_calendar_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def update_calendar_completion(service, sub_event, completed):
+    # Runs on the calendar executor: no Streamlit calls here, errors surface through the future
+    # Events created before the original title and color were stored need one read, persisted for later toggles
+    looked_up = 'originalSummary' not in sub_event or 'originalColorId' not in sub_event
+    if looked_up:
+        calendar_event = service.events().get(calendarId='primary', eventId=sub_event['id'], fields='summary,colorId').execute(num_retries=API_RETRIES)
+        sub_event.setdefault('originalSummary', calendar_event['summary'].replace("Completed: ", ""))
+        sub_event.setdefault('originalColorId', calendar_event.get('colorId', '1'))
+    if completed:
+        patch_body = {'summary': f"Completed: {sub_event['originalSummary']}", 'colorId': '8'}  # Graphite
+    else:
+        patch_body = {'summary': sub_event['originalSummary'], 'colorId': sub_event['originalColorId']}
+    service.events().patch(calendarId='primary', eventId=sub_event['id'], body=patch_body, fields='id').execute(num_retries=API_RETRIES)
+    return looked_up
+
+def collect_calendar_updates():
+    # Report background updates that finished since the last run
+    pending_updates = []
+    finished = looked_up = False
+    for sub_event_id, future in st.session_state.get('pending_calendar_updates', []):
+        if not future.done():
+            pending_updates.append((sub_event_id, future))
+            continue
+        finished = True
+        if future.exception() is not None:
+            st.error(f"An error occurred while updating event {sub_event_id}: {future.exception()}")
+        else:
+            looked_up = looked_up or future.result()
+    st.session_state['pending_calendar_updates'] = pending_updates
+    if finished:
+        list_events_cached.clear()
+    if looked_up:
+        # Persist the original summary/color the worker had to look up
+        mark_history_dirty(get_event_history())
+
+def get_event_index(history):
+    # Maps event ID -> event; rebuilt only when created_events is replaced or changes length
+    events = history['created_events']
+    cached = st.session_state.get('event_index')
+    if cached is None or cached[0] is not events or cached[1] != len(events):
+        cached = (events, len(events), {event['id']: event for event in events})
+        st.session_state['event_index'] = cached
+    return cached[2]
 
 def toggle_completion(service, event_id, sub_event_id):
     history = get_event_history()
-    for event in history['created_events']:
-        if event['id'] == event_id:
-            for sub_event in event['sub_events']:
-                if sub_event['id'] == sub_event_id:
-                    sub_event['completed'] = not sub_event['completed']
-                    # Update Google Calendar event
-                    try:
-                        calendar_event = service.events().get(calendarId='primary', eventId=sub_event_id).execute()
-                        if 'originalColorId' not in sub_event:
-                            sub_event['originalColorId'] = calendar_event.get('colorId', '1')
-                        if sub_event['completed']:
-                            calendar_event['summary'] = f"Completed: {calendar_event['summary']}"
-                            calendar_event['colorId'] = '8'  # Graphite
-                        else:
-                            calendar_event['summary'] = calendar_event['summary'].replace("Completed: ", "")
-                            calendar_event['colorId'] = sub_event['originalColorId']
-                        service.events().update(calendarId='primary', eventId=sub_event_id, body=calendar_event).execute()
-                    except googleapiclient.errors.HttpError as error:
-                        st.error(f"An error occurred while updating event {sub_event_id}: {error}")
-                    save_event_history(history)
-                    # Update session state directly
-                    st.session_state['event_history'] = history
-                    return
+    event = get_event_index(history).get(event_id)
+    if event is None:
+        return
+    for sub_event in event['sub_events']:
+        if sub_event['id'] == sub_event_id:
+            sub_event['completed'] = not sub_event['completed']
+            append_history_log({'op': 'toggle', 'sub_event': sub_event_id, 'completed': sub_event['completed']})
+            # Update Google Calendar event off the UI path; the checkbox's own rerun shows the new state
+            future = get_calendar_executor().submit(update_calendar_completion, service, sub_event, sub_event['completed'])
+            st.session_state.setdefault('pending_calendar_updates', []).append((sub_event_id, future))
+            return
+
+PROGRESS_DOT_FILLED = '<span style="color:green;">&#9679;</span> '  # filled circle part
+PROGRESS_DOT_EMPTY = '<span style="color:lightgrey;">&#9675;</span> '  # unfilled circle part
+
+@functools.lru_cache(maxsize=64)
+def progress_dots(completed_sub_events, total_sub_events):
+    # Filled dots always come first, so the markup depends only on the two counts
+    return (PROGRESS_DOT_FILLED * completed_sub_events + PROGRESS_DOT_EMPTY * (total_sub_events - completed_sub_events)).rstrip()
 
 def render_progress_circle(event):
-    total_sub_events = len(event['sub_events'])
-    completed_sub_events = sum(1 for sub_event in event['sub_events'] if sub_event['completed'])
-    
-    circle_parts = []
-    for i in range(total_sub_events):
-        if i < completed_sub_events:
-            circle_parts.append('<span style="color:green;">&#9679;</span>')  # filled circle part
-        else:
-            circle_parts.append('<span style="color:lightgrey;">&#9675;</span>')  # unfilled circle part
-    
-    return ' '.join(circle_parts)
+    return progress_dots(count_completed(event), len(event['sub_events']))
+
+def count_completed(event):
+    return sum(1 for sub_event in event['sub_events'] if sub_event['completed'])
+
+# Sorting options -> (key function, reverse); sorted() evaluates each key once per event, not per comparison
+SORT_KEYS = {
+    "Title": (operator.itemgetter('title'), False),
+    "Date": (operator.itemgetter('date'), False),
+    "Completion": (count_completed, True),
+}
 
 # Sorting function
 def sort_events(events, sort_option):
-    if sort_option == "Title":
-        return sorted(events, key=lambda x: x['title'])
-    elif sort_option == "Date":
-        return sorted(events, key=lambda x: x['date'])
-    elif sort_option == "Completion":
-        return sorted(events, key=lambda x: sum(1 for sub_event in x['sub_events'] if sub_event['completed']), reverse=True)
-    else:
+    if sort_option not in SORT_KEYS:
         return events
+    key, reverse = SORT_KEYS[sort_option]
+    return sorted(events, key=key, reverse=reverse)
+
+@functools.lru_cache(maxsize=8)
+def day_bounds(day: datetime.date):
+    # (time_min, time_max) strings for a whole Sri Lanka day; the picked date rarely changes between reruns
+    return (SRI_LANKA_TZ.localize(datetime.datetime.combine(day, datetime.time.min)).isoformat(),
+            SRI_LANKA_TZ.localize(datetime.datetime.combine(day, datetime.time.max)).isoformat())
+
+def show_more_events():
+    st.session_state.events_shown += EVENTS_PAGE_SIZE
 
 def main():
+    today = datetime.date.today()
     creds = get_credentials()
 
     if not creds:
@@ -194,7 +523,7 @@ def main():
         return
 
     try:
-        service = build('calendar', 'v3', credentials=creds)
+        service = get_service(creds.token, creds)
     except googleapiclient.errors.HttpError as error:
         st.error(f"An error occurred: {error}")
         return
@@ -202,14 +531,18 @@ def main():
     st.title('Google Calendar Event Scheduler')
 
     # Load or verify event history
-    if 'event_history' not in st.session_state:
+    if 'event_history' not in st.session_state or time.time() - st.session_state['verified_at'] > VERIFY_INTERVAL:
         history = get_event_history()
-        updated_history = verify_events(service, history)
-        if history != updated_history:
-            save_event_history(updated_history)
+        # Reruns within VERIFY_INTERVAL reuse the verified copy in session state
+        updated_history, changed = verify_events(service, history)
+        st.session_state['verified_at'] = time.time()
         st.session_state['event_history'] = updated_history
+        if changed:
+            mark_history_dirty(updated_history)
     else:
-        updated_history = st.session_state['event_history']
+        updated_history = get_event_history()
+
+    collect_calendar_updates()
 
     # Right Sidebar for Progress Tracker
     st.sidebar.title('Your Progress')
@@ -217,13 +550,14 @@ def main():
     # Add sorting dropdown
     sort_option = st.sidebar.selectbox("Sort by:", ["Title", "Date", "Completion"], index=0)
 
-    if 'event_checkboxes' not in st.session_state:
-        st.session_state.event_checkboxes = {}
+    if 'events_shown' not in st.session_state:
+        st.session_state.events_shown = EVENTS_PAGE_SIZE
 
-    # Sort events based on selected option
-    sorted_events = sort_events(updated_history['created_events'], sort_option)
+    # Render the most recently created series (created_events is in creation order); only that window is sorted
+    created_events = updated_history['created_events']
+    visible_events = sort_events(created_events[-st.session_state.events_shown:], sort_option)
 
-    for event in sorted_events:
+    for event in visible_events:
         event_id = event['id']
         event_title = event['title']
         if len(event_title) > 20:
@@ -242,37 +576,42 @@ def main():
             with col2:
                 if st.button("🗑️", key=f"delete_main_{event_id}"):
                     try:
-                        for sub_event in event['sub_events']:
-                            service.events().delete(calendarId='primary', eventId=sub_event['id']).execute()
+                        _, delete_errors = run_batch(service, [(sub_event['id'], service.events().delete(calendarId='primary', eventId=sub_event['id'])) for sub_event in event['sub_events']])
+                        # Reviews already removed from the calendar by hand answer 404/410; they count as deleted
+                        failures = [error for error in delete_errors.values() if error.resp.status not in (404, 410)]
+                        if failures:
+                            raise failures[0]
                         updated_history['created_events'] = [e for e in updated_history['created_events'] if e['id'] != event_id]
-                        save_event_history(updated_history)
-                        st.session_state['event_history'] = updated_history
+                        mark_history_dirty(updated_history)
+                        list_events_cached.clear()
                         st.sidebar.success(f"Deleted {event['title']} successfully!")
                     except googleapiclient.errors.HttpError as error:
                         st.error(f"An error occurred while deleting event {event_id}: {error}")
 
+    hidden_count = len(created_events) - len(visible_events)
+    if hidden_count > 0:
+        st.sidebar.button(f"Show older events ({hidden_count})", on_click=show_more_events)
+
     # Display events from selected date
     selected_date = st.sidebar.date_input("Select a date to view events:")
-    time_min = datetime.datetime.combine(selected_date, datetime.time.min).isoformat() + 'Z'
-    time_max = datetime.datetime.combine(selected_date, datetime.time.max).isoformat() + 'Z'
-    existing_events = get_existing_events(service, time_min=time_min, time_max=time_max)
+    time_min, time_max = day_bounds(selected_date)
+    existing_events = get_existing_events(service, creds.token, time_min=time_min, time_max=time_max)
 
     if not existing_events:
         st.sidebar.write("No events found.")
     else:
-        for event in existing_events:
-            event_start = isoparse(event['start'].get('dateTime', event['start'].get('date')))
-            event_end = isoparse(event['end'].get('dateTime', event['end'].get('date')))
-            event_duration = event_end - event_start
-            event_summary = event.get('summary', 'No Title')
-            event_description = event.get('description', '')
-            st.sidebar.write(f"**{event_description}**")  # Display description instead of summary
-            st.sidebar.write(f"- Time: {event_start.strftime('%I:%M %p')} - {event_end.strftime('%I:%M %p')}")
-            st.sidebar.write(f"- Duration: {event_duration}")
-            st.sidebar.write("---")
+        event_blocks = [
+            render_existing_event(
+                event.get('description', ''),  # Display description instead of summary
+                event['start'].get('dateTime', event['start'].get('date')),
+                event['end'].get('dateTime', event['end'].get('date')),
+            )
+            for event in existing_events
+        ]
+        st.sidebar.markdown('\n\n'.join(event_blocks))
 
     if 'event_date' not in st.session_state:
-        st.session_state.event_date = datetime.date.today()
+        st.session_state.event_date = today
 
     if 'event_time' not in st.session_state:
         st.session_state.event_time = datetime.time(9, 0)
@@ -288,16 +627,6 @@ def main():
 
     subjects = ["Physics", "Chemistry", "Combined Maths"]  # List of subjects
 
-    st.session_state.event_date = st.date_input("Enter the date you first studied the topic:", value=st.session_state.event_date)
-    st.session_state.event_time = st.time_input("Enter the time you first studied the topic:", value=st.session_state.event_time)
-    st.session_state.study_duration = st.number_input("Enter the duration of your study session (in minutes):", min_value=1, value=st.session_state.study_duration)
-
-    # Dropdown for subjects
-    st.session_state.event_subject = st.selectbox("Select your subject:", subjects, index=subjects.index(st.session_state.event_subject))
-
-    # Text area for event description
-    st.session_state.event_description = st.text_area("Enter a description for the study session:", value=st.session_state.event_description)
-
     intervals = [1, 3, 7, 16, 30, 90, 180]  # Days for review intervals
     interval_actions = {
         1: 'Review notes',
@@ -309,69 +638,106 @@ def main():
         180: 'Deep review',
     }
 
-    if st.button("Schedule Event"):
+    # Batch the inputs in a form so editing them doesn't rerun the whole script
+    with st.form('schedule_form'):
+        st.session_state.event_date = st.date_input("Enter the date you first studied the topic:", value=st.session_state.event_date)
+        st.session_state.event_time = st.time_input("Enter the time you first studied the topic:", value=st.session_state.event_time)
+        st.session_state.study_duration = st.number_input("Enter the duration of your study session (in minutes):", min_value=1, value=st.session_state.study_duration)
+
+        # Dropdown for subjects
+        st.session_state.event_subject = st.selectbox("Select your subject:", subjects, index=subjects.index(st.session_state.event_subject))
+
+        # Text area for event description
+        st.session_state.event_description = st.text_area("Enter a description for the study session:", value=st.session_state.event_description)
+
+        submitted = st.form_submit_button("Schedule Event")
+
+    if submitted:
         start_datetime = datetime.datetime.combine(st.session_state.event_date, st.session_state.event_time)
         end_datetime = start_datetime + datetime.timedelta(minutes=st.session_state.study_duration)
-        new_event_id = None  # ID for the main event to group sub-events
 
         new_event = {
-            'id': new_event_id,  # Will be updated after creating the first event
+            'id': None,  # Set to the first review's ID once the events are created
             'title': st.session_state.event_description,  # Use description as the main title
             'date': st.session_state.event_date.isoformat(),
+            'tagged': True,  # Created with APP_EVENT_PROPERTY, so verification can use the filtered listing
             'sub_events': []
         }
 
-        all_events_created = True
+        # Fields shared by every review event; only the title and times change per interval
+        study_duration = datetime.timedelta(minutes=st.session_state.study_duration)
+        base_body = {
+            'description': st.session_state.event_description,
+            'colorId': get_color_id(st.session_state.event_subject),
+            'extendedProperties': {'private': dict([APP_EVENT_PROPERTY])},
+        }
+        time_zone = {'timeZone': SRI_LANKA_TZ.zone}
 
+        review_names = {}
+        insert_requests = []
         for days in intervals:
             review_date = start_datetime + datetime.timedelta(days=days)
-            review_end_datetime = review_date + datetime.timedelta(minutes=st.session_state.study_duration)
-            
+            review_end_datetime = review_date + study_duration
+            review_names[str(days)] = f"Day {days}: {interval_actions[days]}"
+
             event_body = {
-                'summary': f"Day {days}: {interval_actions[days]}",
-                'description': st.session_state.event_description,
-                'start': {
-                    'dateTime': review_date.isoformat(),
-                    'timeZone': 'Asia/Colombo',
-                },
-                'end': {
-                    'dateTime': review_end_datetime.isoformat(),
-                    'timeZone': 'Asia/Colombo',
-                },
-                'colorId': get_color_id(st.session_state.event_subject),
+                **base_body,
+                'summary': review_names[str(days)],
+                'start': {'dateTime': review_date.isoformat(), **time_zone},
+                'end': {'dateTime': review_end_datetime.isoformat(), **time_zone},
             }
-
+            insert_requests.append((str(days), service.events().insert(calendarId='primary', body=event_body)))
+
+        # Create every review event in one batched HTTP request
+        try:
+            created_events, insert_errors = run_batch(service, insert_requests)
+        except googleapiclient.errors.HttpError as error:
+            created_events, insert_errors = {}, {'batch': error}
+        for error in insert_errors.values():
+            st.error(f"An error occurred: {error}")
+        all_events_created = not insert_errors
+        if insert_errors and created_events:
+            # Roll back the reviews that did land, so a failed submit doesn't leave an untracked partial series
             try:
-                event = service.events().insert(calendarId='primary', body=event_body).execute()
-                if new_event_id is None:
-                    new_event_id = event['id']
-                    new_event['id'] = new_event_id  # Update the main event ID after the first event is created
+                _, rollback_errors = run_batch(service, [(request_id, service.events().delete(calendarId='primary', eventId=response['id'])) for request_id, response in created_events.items()])
+            except googleapiclient.errors.HttpError as error:
+                rollback_errors = dict.fromkeys(created_events, error)
+            # Reviews that couldn't be removed are recorded below, so the trash button can still delete them
+            created_events = {request_id: created_events[request_id] for request_id, error in rollback_errors.items() if error.resp.status not in (404, 410)}
 
+        for request_id, review_name in review_names.items():
+            if request_id in created_events:
                 new_event['sub_events'].append({
-                    'id': event['id'],
-                    'name': f"Day {days}: {interval_actions[days]}",  # Set subtitle as "Day X: [Action]"
-                    'completed': False
+                    'id': created_events[request_id]['id'],
+                    'name': review_name,  # Set subtitle as "Day X: [Action]"
+                    'completed': False,
+                    # Kept so completion toggles can patch the event without reading it first
+                    'originalSummary': review_name,
+                    'originalColorId': base_body['colorId'],
                 })
 
-            except googleapiclient.errors.HttpError as error:
-                st.error(f"An error occurred: {error}")
-                all_events_created = False
-                break  # Exit if there's an error in event creation
+        if new_event['sub_events']:
+            new_event['id'] = new_event['sub_events'][0]['id']
+            list_events_cached.clear()
+            updated_history['created_events'].append(new_event)
+            mark_history_dirty(updated_history)
+
+        if not all_events_created and new_event['sub_events']:
+            st.warning("Some review events could not be removed after the error; delete the partial series from the sidebar before trying again.")
 
         if all_events_created:
             st.success("All review events created successfully!")
-            updated_history['created_events'].append(new_event)
-            save_event_history(updated_history)
-
-            # Update session state directly
-            st.session_state['event_history'] = updated_history
 
             # Reset input fields
-            st.session_state.event_date = datetime.date.today()
+            st.session_state.event_date = today
             st.session_state.event_time = datetime.time(9, 0)
             st.session_state.study_duration = 60
             st.session_state.event_subject = "Physics"
             st.session_state.event_description = ""
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        # Also runs when Streamlit interrupts the script for a rerun
+        flush_event_history()
\ No newline at end of file